@@ -1,3 +1,4 @@
+import anyio
 from fastapi import APIRouter, UploadFile, File, HTTPException
 from app.services.analyzer import analyze_image, analyze_bytes
 import logging
@@ -30,7 +31,8 @@ async def analyze_frame_route(file: UploadFile = File(...)):
     try:
         file_bytes = await file.read()
         logger.info(f"Tamaño frame: {len(file_bytes)} bytes")
-        result = analyze_bytes(file_bytes)
+        # Inferencia en un hilo del pool para no bloquear el event loop
+        result = await anyio.to_thread.run_sync(analyze_bytes, file_bytes)
         logger.info(f"Frame procesado con {result.get('num_faces')} rostro(s)")
         return result
     except Exception as e:
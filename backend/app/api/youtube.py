@@ -1,11 +1,19 @@
 
+import os
 import logging
+import threading
+import anyio
+from concurrent.futures import Future, ThreadPoolExecutor
 from fastapi import APIRouter, HTTPException, BackgroundTasks
 
 
 # Importaremos el analizador en el siguiente paso
 from app.services.video_processor import process_video
-from app.services.youtube_dowload import YouTubeRequest, download_youtube_video
+from app.services.youtube_dowload import (
+    YouTubeRequest,
+    download_youtube_audio,
+    download_youtube_video,
+)
 
 
 logger = logging.getLogger(__name__)
@@ -14,6 +22,25 @@ logger.setLevel(logging.INFO)
 
 router = APIRouter()
 
+# Descargas de audio que corren en paralelo con el procesamiento del video
+audio_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="yt-audio")
+
+
+def remove_file(path: str):
+    """Elimina un archivo temporal si todavía existe."""
+    try:
+        if os.path.exists(path):
+            os.remove(path)
+            logger.info(f"🗑️ Archivo temporal eliminado: {path}")
+    except OSError as e:
+        logger.warning(f"No se pudo eliminar {path}: {e}")
+
+
+def remove_audio_file(future: Future):
+    """Elimina el audio descargado en cuanto su descarga termine."""
+    if not future.cancelled() and future.exception() is None:
+        remove_file(future.result())
+
 
 @router.post("/analyze-youtube")
 async def analyze_youtube_video(request: YouTubeRequest, background_tasks: BackgroundTasks):
@@ -25,24 +52,43 @@ async def analyze_youtube_video(request: YouTubeRequest, background_tasks: Backg
 
     # Validar URL
     url = request.url.strip()
-    if not url.startswith("http") or "youtube.com" not in url and "youtu.be" not in url:
+    if not url.startswith("http") or ("youtube.com" not in url and "youtu.be" not in url):
         raise HTTPException(status_code=400, detail="URL de YouTube inválida")
 
-    # Paso 1: Descargar video temporalmente
+    # Paso 1: Lanzar la descarga del audio en paralelo; solo se necesita al final
+    cancel_audio = threading.Event()
+    audio_future = audio_executor.submit(download_youtube_audio, url, cancel_audio)
+
+    def stop_audio():
+        """Cancela la descarga de audio si aún no empezó o la aborta si está en curso."""
+        audio_future.cancel()
+        cancel_audio.set()
+        audio_future.add_done_callback(remove_audio_file)
+
+    # Paso 2: Descargar solo el video (en un hilo, sin bloquear el event loop)
     try:
-        video_path = download_youtube_video(url)
+        video_path = await anyio.to_thread.run_sync(download_youtube_video, url)
     except HTTPException as e:
+        stop_audio()
         raise e
     except Exception as e:
         logger.exception("Fallo inesperado en descarga")
+        stop_audio()
         raise HTTPException(status_code=500, detail=str(e))
 
-    # Paso 2: Procesar el video
+    # Paso 3: Procesar el video mientras termina el audio (CPU/GPU en un hilo del pool)
     try:
-        result = process_video(video_path)
+        result = await anyio.to_thread.run_sync(process_video, video_path, audio_future)
     except Exception as e:
         logger.exception("Error en el procesamiento del video")
+        remove_file(video_path)
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # Si process_video dejó de esperar el audio (error o timeout), abortar la descarga
+        stop_audio()
+
+    # El video descargado se elimina tras enviar la respuesta
+    background_tasks.add_task(remove_file, video_path)
 
     # Devuelve respuesta con ruta local (temporal) y resumen
     return {
@@ -1,15 +1,21 @@
 import io
 import os
+import anyio
 import cv2
 import numpy as np
 from PIL import Image
-from typing import Dict
+from typing import Dict, List
 import tensorflow as tf
 from tensorflow.keras.models import load_model
-from mtcnn import MTCNN
-import threading
+import queue
 import logging
 import time
+from contextlib import contextmanager
+
+try:
+    import onnxruntime as ort
+except ImportError:  # ONNX Runtime es opcional: sin él se usa Keras
+    ort = None
 
 # ========== CONFIGURAR LOGGING ==========
 logging.basicConfig(
@@ -22,7 +28,41 @@ logger = logging.getLogger(__name__)
 logger.info("Inicializando detector y modelo de emociones")
 
 start_time = time.time() 
-detector = MTCNN()
+
+DETECTOR_PATH = os.getenv(
+    "DETECTOR_PATH",
+    os.path.join(os.path.dirname(__file__), "..", "model", "face_detection_yunet_2023mar.onnx")
+)
+logger.info(f"Ruta del detector: {DETECTOR_PATH}")
+
+# Objetos de OpenCV con estado interno (YuNet, CLAHE): no se comparten entre hilos
+# a la vez, así que se reparten desde un pool creado una sola vez al importar.
+CV_POOL_SIZE = max(1, int(os.getenv("CV_POOL_SIZE", str(min(4, os.cpu_count() or 1)))))
+
+
+def create_detector():
+    """Crea un detector YuNet; falla si el modelo ONNX no existe o no se puede cargar."""
+    if not os.path.exists(DETECTOR_PATH):
+        raise FileNotFoundError(f"No se encontró el modelo del detector: {DETECTOR_PATH}")
+    return cv2.FaceDetectorYN.create(DETECTOR_PATH, "", (0, 0), score_threshold=0.85)
+
+
+_detector_pool = queue.Queue()
+_clahe_pool = queue.Queue()
+for _ in range(CV_POOL_SIZE):
+    _detector_pool.put(create_detector())
+    _clahe_pool.put(cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)))
+
+
+@contextmanager
+def borrow(pool: queue.Queue):
+    """Toma un objeto del pool (esperando si están todos en uso) y lo devuelve al salir."""
+    item = pool.get()
+    try:
+        yield item
+    finally:
+        pool.put(item)
+
 
 MODEL_PATH = os.getenv(
     "MODEL_PATH",
@@ -30,30 +70,75 @@ MODEL_PATH = os.getenv(
 )
 logger.info(f"Ruta del modelo: {MODEL_PATH}")
 
-# Cargar modelo ResNet50
-model = load_model(MODEL_PATH, compile=False)
-model.compile(optimizer="adam", loss="sparse_categorical_crossentropy", metrics=["accuracy"])
+TARGET_SIZE = 224
+MAX_BATCH = 16             # Lote máximo por llamada al modelo (ONNX/TensorRT y Keras)
+BATCH_BUCKETS = (1, 2, 4, 8, 16)  # Keras/XLA: los lotes se rellenan hasta la cubeta siguiente
+
+# Modelo exportado con scripts/export_onnx.py (se usa si existe y hay onnxruntime)
+ONNX_MODEL_PATH = os.getenv("ONNX_MODEL_PATH", os.path.splitext(MODEL_PATH)[0] + ".onnx")
+# Engines de TensorRT ya construidos, reutilizados entre arranques
+TRT_CACHE_DIR = os.getenv(
+    "TRT_CACHE_DIR",
+    os.path.join(os.path.dirname(ONNX_MODEL_PATH), "trt_cache")
+)
+
+
+def build_onnx_providers(input_name: str, available: list) -> list:
+    """
+    Proveedores de ONNX Runtime en orden de preferencia (TensorRT en FP16, CUDA, CPU).
+    TensorRT recibe un perfil de formas fijo (lote 1..MAX_BATCH) y caché de engines
+    para no reconstruir el engine cuando cambia el tamaño de lote.
+    """
+    shape = f"{TARGET_SIZE}x{TARGET_SIZE}x3"
+    trt_options = {
+        "trt_fp16_enable": True,
+        "trt_engine_cache_enable": True,
+        "trt_engine_cache_path": TRT_CACHE_DIR,
+        "trt_profile_min_shapes": f"{input_name}:1x{shape}",
+        "trt_profile_opt_shapes": f"{input_name}:{MAX_BATCH // 2}x{shape}",
+        "trt_profile_max_shapes": f"{input_name}:{MAX_BATCH}x{shape}",
+    }
+    providers = [
+        ("TensorrtExecutionProvider", trt_options),
+        "CUDAExecutionProvider",
+        "CPUExecutionProvider",
+    ]
+    return [p for p in providers if (p[0] if isinstance(p, tuple) else p) in available]
+
+
+session = None
+model = None
+if ort is not None and os.path.exists(ONNX_MODEL_PATH):
+    available = ort.get_available_providers()
+    session_input = "input"
+    if "TensorrtExecutionProvider" in available:
+        # El perfil de TensorRT necesita el nombre real de la entrada
+        session_input = ort.InferenceSession(
+            ONNX_MODEL_PATH, providers=["CPUExecutionProvider"]
+        ).get_inputs()[0].name
+        os.makedirs(TRT_CACHE_DIR, exist_ok=True)
+    session = ort.InferenceSession(
+        ONNX_MODEL_PATH, providers=build_onnx_providers(session_input, available)
+    )
+    session_input = session.get_inputs()[0].name
+    logger.info(f"Modelo ONNX cargado ({ONNX_MODEL_PATH}) con {session.get_providers()}")
+else:
+    # Cargar modelo ResNet50
+    model = load_model(MODEL_PATH, compile=False)
+    model.compile(optimizer="adam", loss="sparse_categorical_crossentropy", metrics=["accuracy"])
 load_time = time.time() - start_time
 logger.info(f"Modelo cargado correctamente en {load_time:.2f}s")
 
 # Parámetros globales
-TARGET_SIZE = 224
+DETECTION_MAX_SIZE = 640   # Lado máximo de la imagen usada para detectar rostros
 USE_GRAYSCALE = True
 USE_CLAHE = True
-DEBUG_SAVE_FRAMES = True   # 👈 Activa/desactiva guardado de rostros procesados
-DEBUG_DIR = os.path.join(os.path.dirname(__file__), "..", "debug_faces")
 
 CLASS_NAMES = ['angry','disgust','fear','happy','neutral','sad','surprise']
-model_lock = threading.Lock()
+RESNET_MEAN = np.array([103.939, 116.779, 123.68], dtype=np.float32)  # BGR, modo caffe
 
 
 # ========== UTILIDADES ==========
-def ensure_dir(path: str):
-    """Crea el directorio si no existe."""
-    if not os.path.exists(path):
-        os.makedirs(path, exist_ok=True)
-
-
 def read_image_to_rgb(file_bytes: bytes) -> np.ndarray:
     """Convierte bytes de imagen a RGB (mantiene compatibilidad con PIL)."""
     try:
@@ -66,31 +151,37 @@ def read_image_to_rgb(file_bytes: bytes) -> np.ndarray:
 
 def detect_faces(img_rgb: np.ndarray):
     """
-    Detecta rostros en una imagen RGB usando MTCNN.
+    Detecta rostros en una imagen RGB usando YuNet (cv2.FaceDetectorYN).
     Devuelve una lista de bounding boxes [(x, y, w, h)].
     """
+    h_img, w_img = img_rgb.shape[:2]
+
+    # Detectar sobre una copia reducida; los recortes se hacen a resolución completa
+    scale = 1.0
+    img_det = img_rgb
+    if max(h_img, w_img) > DETECTION_MAX_SIZE:
+        scale = DETECTION_MAX_SIZE / max(h_img, w_img)
+        img_det = cv2.resize(img_rgb, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
     try:
-        detections = detector.detect_faces(img_rgb)
+        img_bgr = cv2.cvtColor(img_det, cv2.COLOR_RGB2BGR)
+        with borrow(_detector_pool) as detector:
+            detector.setInputSize((img_bgr.shape[1], img_bgr.shape[0]))
+            _, faces = detector.detect(img_bgr)
     except Exception as e:
-        logger.warning(f"Error interno de MTCNN: {e}")
+        logger.warning(f"Error interno de YuNet: {e}")
         return []
 
-    bboxes = []
-    for det in detections:
-        # Validar formato correcto
-        if not isinstance(det, dict):
-            logger.debug(f"Detección no válida (tipo {type(det)}): {det}")
-            continue
-        if "box" not in det:
-            logger.debug(f"Detección sin clave 'box': {det.keys()}")
-            continue
-        if "confidence" in det and det["confidence"] < 0.85:
-            logger.debug("Rostro ignorado por baja confianza (<0.85)")
-            continue
+    if faces is None:
+        logger.info("Detectadas 0 caras válidas.")
+        return []
 
-        x, y, w, h = det["box"]
-        x, y = max(0, x), max(0, y)
-        w, h = max(1, w), max(1, h)
+    bboxes = []
+    # Cada fila: x, y, w, h, 5 landmarks (x, y), score
+    for x, y, w, h, *_ in faces:
+        x, y, w, h = x / scale, y / scale, w / scale, h / scale
+        x, y = max(0, int(x)), max(0, int(y))
+        w, h = max(1, int(w)), max(1, int(h))
 
         # Evitar rostros diminutos (ruido)
         if w < 30 or h < 30:
@@ -104,67 +195,170 @@ def detect_faces(img_rgb: np.ndarray):
 
 
 
+# ========== INFERENCIA ==========
+@tf.function(jit_compile=True)
+def _infer(x):
+    """
+    Pasada directa del modelo Keras compilada con XLA (sin pasar por model.predict).
+    No se llama directamente: se usa la función concreta de cada cubeta.
+    """
+    return model(x, training=False)
+
+
+# Una función concreta por cubeta, trazada una sola vez al importar
+_infer_by_bucket = {
+    b: _infer.get_concrete_function(tf.TensorSpec([b, TARGET_SIZE, TARGET_SIZE, 3], tf.float32))
+    for b in BATCH_BUCKETS
+} if model is not None else {}
+
+
+def predict_batch(batch: np.ndarray) -> np.ndarray:
+    """
+    Ejecuta el modelo de emociones sobre un lote (N, 224, 224, 3) float32.
+    Usa ONNX Runtime si está cargado; si no, el modelo Keras.
+    Ambos caminos admiten llamadas concurrentes desde varios hilos sin bloqueo.
+    Los lotes se parten en trozos de MAX_BATCH (límite del perfil de TensorRT).
+    """
+    outputs = []
+    for start in range(0, len(batch), MAX_BATCH):
+        chunk = batch[start:start + MAX_BATCH]
+        if session is not None:
+            outputs.append(session.run(None, {session_input: chunk})[0])
+            continue
+        # Keras/XLA: relleno con ceros hasta la cubeta siguiente para no recompilar
+        n = len(chunk)
+        bucket = next(b for b in BATCH_BUCKETS if b >= n)
+        if n < bucket:
+            padded = np.zeros((bucket, TARGET_SIZE, TARGET_SIZE, 3), dtype=np.float32)
+            padded[:n] = chunk
+            chunk = padded
+        outputs.append(_infer_by_bucket[bucket](tf.constant(chunk)).numpy()[:n])
+    return np.concatenate(outputs)
+
+
+def warmup():
+    """
+    Ejecuta una inferencia y una detección con entradas vacías para que la
+    compilación XLA / autotune de cuDNN ocurra al arrancar y no en la primera petición.
+    Un fallo aquí detiene el arranque en lugar de degradar las peticiones.
+    """
+    t0 = time.time()
+    # Keras: compilar cada cubeta; ONNX Runtime no compila por tamaño de lote
+    for bucket in (BATCH_BUCKETS if model is not None else (1,)):
+        predict_batch(np.zeros((bucket, TARGET_SIZE, TARGET_SIZE, 3), dtype=np.float32))
+
+    # Calentar (y validar) todos los detectores del pool
+    detectors = [_detector_pool.get() for _ in range(CV_POOL_SIZE)]
+    try:
+        for detector in detectors:
+            detector.setInputSize((320, 320))
+            detector.detect(np.zeros((320, 320, 3), dtype=np.uint8))
+    finally:
+        for detector in detectors:
+            _detector_pool.put(detector)
+    logger.info(f"Calentamiento completado en {time.time() - t0:.2f}s")
+
+
+warmup()
+
+
 # ========== PROCESAMIENTO DEL ROSTRO ==========
-def preprocess_face(face_rgb: np.ndarray, frame_id: int, face_id: int) -> np.ndarray:
+def preprocess_face(face_rgb: np.ndarray, out: np.ndarray = None) -> np.ndarray:
     """
     Recorta y prepara el rostro para la red neuronal.
-    Aplica escala de grises + CLAHE y guarda la imagen final usada por el modelo.
+    Aplica escala de grises + CLAHE y devuelve un array (224, 224, 3) float32.
+    Si se pasa `out` (p. ej. una fila del lote), se escribe directamente ahí.
     """
     # 1️⃣ Escala de grises
     face_gray = cv2.cvtColor(face_rgb, cv2.COLOR_RGB2GRAY)
 
     # 2️⃣ Realce de contraste (CLAHE)
     if USE_CLAHE:
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-        face_gray = clahe.apply(face_gray)
+        with borrow(_clahe_pool) as clahe:
+            face_gray = clahe.apply(face_gray)
 
-    # 3️⃣ Convertir a RGB (3 canales duplicados)
-    face_rgb_ready = cv2.cvtColor(face_gray, cv2.COLOR_GRAY2RGB)
+    # 3️⃣ Redimensionar (un solo canal)
+    resized = cv2.resize(face_gray, (TARGET_SIZE, TARGET_SIZE))
 
-    # 4️⃣ Redimensionar
-    resized = cv2.resize(face_rgb_ready, (TARGET_SIZE, TARGET_SIZE))
+    # 4️⃣ Replicar a 3 canales y restar la media de ResNet en un solo paso.
+    # Equivale a resnet.preprocess_input (modo caffe): con los 3 canales
+    # iguales, el cambio RGB→BGR no altera el resultado.
+    if out is None:
+        out = np.empty((TARGET_SIZE, TARGET_SIZE, 3), dtype=np.float32)
+    np.subtract(resized[..., None], RESNET_MEAN, out=out)
+    return out
 
 
-    # 6️⃣ Convertir a batch y preprocesar para ResNet
-    img_array = np.expand_dims(resized.astype(np.float32), axis=0)
-    img_pre = tf.keras.applications.resnet.preprocess_input(img_array)
-    return img_pre
+def softmax_np(logits: np.ndarray) -> np.ndarray:
+    """
+    Softmax por filas en NumPy (evita lanzar operaciones de TF).
+    Opera in situ sobre `logits` para no reservar arrays intermedios.
+    """
+    logits -= logits.max(axis=1, keepdims=True)
+    np.exp(logits, out=logits)
+    logits /= logits.sum(axis=1, keepdims=True)
+    return logits
 
 
 # ========== FUNCIÓN PRINCIPAL ==========
 def analyze_bytes(file_bytes: bytes) -> Dict:
-    img_rgb = read_image_to_rgb(file_bytes)
-    bboxes = detect_faces(img_rgb)
-
-    if not bboxes:
-        return {"num_faces": 0, "results": []}
+    """Decodifica la imagen recibida por HTTP y la analiza."""
+    return analyze_ndarray(read_image_to_rgb(file_bytes))
 
-    results = []
-    with model_lock:
-        for i, (x, y, w, h) in enumerate(bboxes):
-            roi = img_rgb[y:y+h, x:x+w]
-            if roi.size == 0:
-                continue
 
-            # 🔹 Preprocesar y guardar rostro
-            x_input = preprocess_face(roi, frame_id=0, face_id=i + 1)
+def analyze_ndarray(img_rgb: np.ndarray) -> Dict:
+    """
+    Analiza una imagen RGB ya decodificada (sin pasar por JPEG/PIL).
+    Todos los rostros de la imagen se infieren en un único lote.
+    """
+    return analyze_frames_batch([img_rgb])[0]
 
-            # 🔹 Inferencia
-            preds = model.predict(x_input, verbose=0)[0]
-            probs = tf.nn.softmax(preds).numpy()
-            idx = int(np.argmax(probs))
-            emotion = CLASS_NAMES[idx]
-            confidence = float(probs[idx])
 
-            results.append({
-                "id": i + 1,
-                "bbox": [int(x), int(y), int(w), int(h)],
-                "emotion": emotion,
-                "confidence": confidence,
-                "all_probs": {CLASS_NAMES[j]: float(probs[j]) for j in range(len(CLASS_NAMES))},
-            })
+# ========== ANÁLISIS POR LOTES (VIDEO) ==========
+def analyze_frames_batch(frames: List[np.ndarray]) -> List[Dict]:
+    """
+    Analiza varios frames RGB con una sola llamada al modelo.
+    Detecta rostros frame a frame, apila todos los recortes en un único lote
+    y reparte los resultados por frame (mismo formato que analyze_bytes).
+    """
+    faces = []  # (posición del frame, id del rostro, bbox, recorte)
 
-    return {"num_faces": len(results), "results": results}
+    for frame_pos, img_rgb in enumerate(frames):
+        for i, (x, y, w, h) in enumerate(detect_faces(img_rgb)):
+            roi = img_rgb[y:y+h, x:x+w]
+            if roi.size == 0:
+                continue
+            faces.append((frame_pos, i + 1, (x, y, w, h), roi))
+
+    outputs = [{"num_faces": 0, "results": []} for _ in frames]
+    if not faces:
+        return outputs
+
+    # 🔹 Preprocesar todos los rostros sobre un lote preasignado (N, 224, 224, 3)
+    batch = np.empty((len(faces), TARGET_SIZE, TARGET_SIZE, 3), dtype=np.float32)
+    for i, (_, _, _, roi) in enumerate(faces):
+        preprocess_face(roi, out=batch[i])
+
+    # 🔹 Inferencia única
+    probs = softmax_np(predict_batch(batch).astype(np.float32, copy=False))
+    idxs = probs.argmax(axis=1)
+
+    results = [
+        {
+            "id": face_id,
+            "bbox": [int(x), int(y), int(w), int(h)],
+            "emotion": CLASS_NAMES[idx],
+            "confidence": p[idx],
+            "all_probs": dict(zip(CLASS_NAMES, p)),
+        }
+        for (_, face_id, (x, y, w, h), _), p, idx in zip(faces, probs.tolist(), idxs.tolist())
+    ]
+    for (frame_pos, *_), result in zip(faces, results):
+        outputs[frame_pos]["results"].append(result)
+
+    for out in outputs:
+        out["num_faces"] = len(out["results"])
+    return outputs
 
 
 # ========== ENDPOINT COMPATIBLE ==========
@@ -174,7 +368,8 @@ async def analyze_image(file) -> Dict:
         file_bytes = await file.read()
         if not file_bytes:
             raise ValueError("Archivo vacío o no válido")
-        return analyze_bytes(file_bytes)
+        # Inferencia en un hilo del pool para no bloquear el event loop
+        return await anyio.to_thread.run_sync(analyze_bytes, file_bytes)
     except Exception as e:
         logger.exception("Error en analyze_image")
         raise
@@ -5,74 +5,320 @@ import time
 import logging
 import uuid
 import subprocess
-from app.services.analyzer import analyze_bytes
-from app.services.uploader import compress_video, upload_to_gcs  
+import queue
+import shutil
+import tempfile
+import threading
+from collections import Counter
+from concurrent.futures import Future
+from functools import lru_cache
+from typing import Optional
+from app.services.analyzer import CLASS_NAMES, analyze_frames_batch
+from app.services.uploader import upload_to_gcs
 
 # =========== CONFIGURAR LOGGING ========== #
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# Frames muestreados que se analizan juntos en una sola inferencia
+BATCH_SIZE = int(os.getenv("VIDEO_BATCH_SIZE", "4"))
+# Memoria máxima (MB) de frames BGR retenidos a la espera de su lote. Al llegar
+# al límite el lote se analiza aunque no esté lleno. Coste aproximado por frame:
+# ancho * alto * 3 bytes (≈1.2 MB a 480p, ≈6.2 MB a 1080p).
+MAX_BUFFER_MB = int(os.getenv("VIDEO_MAX_BUFFER_MB", "128"))
+# Capacidad de las colas entre las etapas de lectura, análisis y escritura
+QUEUE_SIZE = 4
+
+# ==== Selección de frames por diferencia entre imágenes ====
+DIFF_SIZE = (64, 36)         # Miniatura en escala de grises usada para comparar
+MOTION_THRESHOLD = 12.0      # Diferencia media que fuerza un análisis anticipado
+
+# ==== Entrada/salida de video ====
+FFMPEG_PATH = shutil.which("ffmpeg") or "C:\\ffmpeg\\bin\\ffmpeg.exe"
+OUTPUT_BITRATE = "1500k"
+# Espera máxima (s) por el audio descargado en paralelo una vez procesados los frames
+AUDIO_WAIT_TIMEOUT = float(os.getenv("AUDIO_WAIT_TIMEOUT", "60"))
+
+# ==== Colores por emoción ====
+COLORS = {
+    "neutral": (189, 195, 199),
+    "happy": (46, 204, 113),
+    "surprise": (241, 196, 15),
+    "sad": (52, 152, 219),
+    "angry": (231, 76, 60),
+    "disgust": (22, 160, 133),
+    "fear": (142, 68, 173),
+}
+
 
 # ==========================================================
-# FUNCIÓN AUXILIAR: COMBINAR AUDIO ORIGINAL CON EL PROCESADO
+# FUNCIONES AUXILIARES: DIBUJAR DETECCIONES SOBRE UN FRAME
 # ==========================================================
-def merge_audio(original_path: str, processed_path: str) -> str:
+@lru_cache(maxsize=1024)
+def label_style(emotion: str, confidence_pct: float) -> tuple:
     """
-    Combina el video procesado con el audio original usando FFmpeg.
+    Etiqueta, ancho del texto y color para una emoción y confianza (en %, 1 decimal).
+    Se memoriza porque las mismas etiquetas se repiten en muchos frames.
     """
-    import shutil
-    ffmpeg_path = shutil.which("ffmpeg") or "C:\\ffmpeg\\bin\\ffmpeg.exe"
-    final_path = processed_path.replace(".mp4", "_with_audio.mp4")
+    label = f"{emotion.upper()} {confidence_pct:.1f}%"
+    (text_w, _), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)
+    return label, text_w, COLORS.get(emotion, (0, 255, 0))
 
-    if not os.path.exists(original_path):
-        logger.warning("⚠️ Archivo original no encontrado para mezclar audio.")
-        return processed_path
-    if not os.path.exists(processed_path):
-        logger.warning("⚠️ Archivo procesado no encontrado para mezclar audio.")
-        return processed_path
 
+def prepare_detections(detections: list) -> list:
+    """
+    Convierte las detecciones del analizador en elementos listos para dibujar
+    (bbox, etiqueta, ancho del texto y color), calculados una vez por frame analizado.
+    """
+    prepared = []
+    for det in detections:
+        bbox = det.get("bbox") or det.get("box")
+        if not bbox or len(bbox) != 4:
+            continue
+        label, text_w, color = label_style(det["emotion"], round(det["confidence"] * 100, 1))
+        prepared.append({
+            "bbox": tuple(map(int, bbox)),
+            "label": label,
+            "text_w": text_w,
+            "color": color,
+        })
+    return prepared
+
+
+def draw_detections(frame: np.ndarray, detections: list) -> None:
+    """
+    Dibuja el recuadro y la etiqueta de cada detección preparada con prepare_detections.
+    """
+    for det in detections:
+        x, y, w, h = det["bbox"]
+        color = det["color"]
+
+        cv2.rectangle(frame, (x, y), (x + w, y + h), color, 2)
+        cv2.rectangle(frame, (x, y - 20), (x + det["text_w"], y), color, -1)
+        cv2.putText(frame, det["label"], (x, y - 5),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1)
+
+
+# ==========================================================
+# FUNCIONES AUXILIARES: DECODIFICACIÓN / CODIFICACIÓN POR HARDWARE
+# ==========================================================
+def open_capture(video_path: str) -> cv2.VideoCapture:
+    """
+    Abre el video con FFmpeg pidiendo decodificación por hardware
+    (VAAPI/CUDA/D3D11 según el host). Si no es posible, usa la decodificación por software.
+    """
+    cap = cv2.VideoCapture(
+        video_path, cv2.CAP_FFMPEG,
+        [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY],
+    )
+    if cap.isOpened():
+        return cap
+    cap.release()
+    logger.info("Decodificación por hardware no disponible, se usa software.")
+    return cv2.VideoCapture(video_path)
+
+
+@lru_cache(maxsize=1)
+def nvenc_available() -> bool:
+    """Comprueba una sola vez si FFmpeg puede codificar con h264_nvenc en este host."""
     command = [
-        ffmpeg_path, "-y",
-        "-i", f'"{processed_path}"',
-        "-i", f'"{original_path}"',
-        "-c:v", "copy",
-        "-map", "0:v:0",
-        "-map", "1:a:0",
-        "-shortest",
-        f'"{final_path}"'
+        FFMPEG_PATH, "-hide_banner", "-loglevel", "error",
+        "-f", "lavfi", "-i", "color=size=256x256:duration=0.1",
+        "-c:v", "h264_nvenc", "-f", "null", "-",
     ]
-    command_str = " ".join(command)
+    try:
+        result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=30)
+    except Exception:
+        return False
+    return result.returncode == 0
+
+
+class NvencWriter:
+    """
+    Escritor de video compatible con cv2.VideoWriter (write/release) que envía
+    los frames BGR crudos a FFmpeg por una tubería y los codifica con NVENC.
+
+    NVENC puede rechazar la sesión al iniciar el codificador (p. ej. límite de
+    sesiones simultáneas en GPUs de consumo). Los primeros frames se retienen
+    hasta confirmar que FFmpeg sigue vivo; si la tubería se rompe en ese tramo,
+    se pasa a cv2.VideoWriter ('mp4v') y se reescriben esos frames.
+    """
+
+    STARTUP_FRAMES = 16  # Frames retenidos hasta dar por iniciado el codificador
+
+    def __init__(self, output_path: str, fps: float, size: tuple):
+        self.output_path = output_path
+        self.fps = fps
+        self.size = size
+        self.is_nvenc = True
+        self.fallback = None
+        self.startup_frames = []
+
+        width, height = size
+        command = [
+            FFMPEG_PATH, "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "bgr24",
+            "-s", f"{width}x{height}", "-r", str(fps),
+            "-i", "-",
+            "-c:v", "h264_nvenc", "-preset", "p1",
+            "-b:v", OUTPUT_BITRATE,
+            "-pix_fmt", "yuv420p",
+            output_path,
+        ]
+        # stderr a un archivo temporal: una tubería sin leer podría bloquear a FFmpeg
+        self.stderr_file = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=self.stderr_file)
+
+    def write(self, frame: np.ndarray) -> None:
+        if self.fallback is not None:
+            self.fallback.write(frame)
+            return
+
+        in_startup = self.startup_frames is not None
+        if in_startup:
+            self.startup_frames.append(frame)
+        try:
+            self.process.stdin.write(frame.tobytes())
+        except (BrokenPipeError, OSError):
+            if not in_startup:
+                raise
+            self._fall_back()
+            return
+
+        if in_startup and len(self.startup_frames) >= self.STARTUP_FRAMES:
+            if self.process.poll() is None:
+                self.startup_frames = None  # Codificador en marcha
+            else:
+                self._fall_back()
+
+    def _fall_back(self) -> None:
+        self._close_process()
+        logger.warning("⚠️ NVENC no disponible para esta sesión, se usa 'mp4v'.")
+        self.is_nvenc = False
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        self.fallback = cv2.VideoWriter(self.output_path, fourcc, self.fps, self.size)
+        for frame in self.startup_frames:
+            self.fallback.write(frame)
+        self.startup_frames = None
+
+    def _close_process(self) -> None:
+        try:
+            if self.process.stdin and not self.process.stdin.closed:
+                self.process.stdin.close()
+        except OSError:
+            pass
+        self.process.wait()
+        if self.process.returncode != 0:
+            self.stderr_file.seek(0)
+            stderr = self.stderr_file.read().decode(errors="ignore")
+            logger.error(f"FFmpeg NVENC falló:\n{stderr}")
+        self.stderr_file.close()
+
+    def release(self) -> None:
+        if self.fallback is not None:
+            self.fallback.release()
+            return
+        self._close_process()
+
+
+def open_writer(output_path: str, fps: float, size: tuple):
+    """
+    Devuelve un escritor H.264 por NVENC si el host lo soporta;
+    si no, cv2.VideoWriter con 'mp4v'.
+    """
+    if nvenc_available():
+        logger.info("Codificando salida con h264_nvenc.")
+        return NvencWriter(output_path, fps, size)
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+    return cv2.VideoWriter(output_path, fourcc, fps, size)
+
 
+# ==========================================================
+# FUNCIÓN AUXILIAR: COMBINAR AUDIO ORIGINAL CON EL PROCESADO
+# ==========================================================
+def run_ffmpeg(command: list, description: str) -> bool:
+    """Ejecuta FFmpeg (sin shell) y devuelve True si terminó correctamente."""
     try:
         result = subprocess.run(
-            command_str,
-            shell=True,
+            command,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             text=True
         )
-        if result.returncode != 0:
-            logger.error(f"FFmpeg mezcla falló:\n{result.stderr}")
-            return processed_path
+    except Exception as e:
+        logger.warning(f"⚠️ FFmpeg {description} no se pudo ejecutar: {e}")
+        return False
+    if result.returncode != 0:
+        logger.error(f"FFmpeg {description} falló:\n{result.stderr}")
+        return False
+    return True
 
-        logger.info(f"✅ Video final con audio generado: {final_path}")
-        return final_path
 
-    except Exception as e:
-        logger.warning(f"⚠️ No se pudo combinar audio: {e}")
+def merge_audio(original_path: str, processed_path: str, reencode: bool = True) -> str:
+    """
+    Combina el video procesado con el audio original usando FFmpeg.
+    Con reencode=True, en la misma pasada recodifica el video a H.264 (1500k)
+    para reducir su tamaño; si ya viene en H.264 (NVENC) se copia tal cual.
+    Si la mezcla falla, se recodifica solo el video para no subir el archivo sin comprimir.
+    """
+    final_path = processed_path.replace(".mp4", "_with_audio.mp4")
+
+    if not os.path.exists(processed_path):
+        logger.warning("⚠️ Archivo procesado no encontrado para mezclar audio.")
         return processed_path
 
+    if reencode:
+        video_codec = ["-c:v", "libx264", "-preset", "veryfast",
+                       "-b:v", OUTPUT_BITRATE, "-bufsize", OUTPUT_BITRATE]
+    else:
+        video_codec = ["-c:v", "copy"]
+
+    if os.path.exists(original_path):
+        command = [
+            FFMPEG_PATH, "-y",
+            "-i", processed_path,
+            "-i", original_path,
+            "-map", "0:v:0",
+            "-map", "1:a:0?",  # "?": si el original no tiene audio, se omite
+            *video_codec,
+            "-c:a", "copy",
+            "-shortest",
+            final_path,
+        ]
+        if run_ffmpeg(command, "mezcla"):
+            logger.info(f"✅ Video final con audio generado: {final_path}")
+            return final_path
+    else:
+        logger.warning("⚠️ Archivo original no encontrado para mezclar audio.")
+
+    # Sin audio: el video de NVENC ya está comprimido; el de mp4v se recodifica
+    if not reencode:
+        return processed_path
+
+    command = [
+        FFMPEG_PATH, "-y",
+        "-i", processed_path,
+        "-map", "0:v:0",
+        *video_codec,
+        final_path,
+    ]
+    if run_ffmpeg(command, "compresión"):
+        logger.info(f"✅ Video final comprimido (sin audio) generado: {final_path}")
+        return final_path
+    return processed_path
+
 
 
 # ==========================================================
 # FUNCIÓN PRINCIPAL: PROCESAR VIDEO COMPLETO
 # ==========================================================
-def process_video(video_path: str) -> dict:
+def process_video(video_path: str, audio_future: Optional[Future] = None) -> dict:
     """
     Procesa un video completo con detección de emociones.
     - Dibuja las detecciones sobre el video.
     - Mantiene persistencia entre frames.
-    - Combina el audio original.
+    - Combina el audio original (del propio video o de `audio_future`, una
+      descarga en paralelo que devuelve la ruta del audio).
     - Sube el resultado final a Google Cloud Storage.
     """
 
@@ -82,7 +328,7 @@ def process_video(video_path: str) -> dict:
     if not os.path.exists(video_path):
         raise FileNotFoundError("El archivo de video no existe.")
 
-    cap = cv2.VideoCapture(video_path)
+    cap = open_capture(video_path)
     if not cap.isOpened():
         raise Exception("No se pudo abrir el video.")
 
@@ -97,136 +343,219 @@ def process_video(video_path: str) -> dict:
     output_id = str(uuid.uuid4())[:8]
     temp_name = f"processed_{output_id}.mp4"
     output_path = os.path.join(os.path.dirname(video_path), temp_name)
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    out = cv2.VideoWriter(output_path, fourcc, fps, (frame_width, frame_height))
+    out = open_writer(output_path, fps, (frame_width, frame_height))
 
     frame_interval = int(fps * 2)  # Analizar 1 frame cada ~2 segundos
+    min_interval = max(1, int(fps * 0.5))  # Con movimiento, como mucho 1 cada ~0.5 s
     processed_frames = 0
     analyzed_frames = 0
 
     # ==== Contadores de emociones ====
-    emotion_counts = {e: 0 for e in ['angry', 'disgust', 'fear', 'happy', 'neutral', 'sad', 'surprise']}
-
-    # ==== Colores por emoción ====
-    COLORS = {
-        "neutral": (189, 195, 199),
-        "happy": (46, 204, 113),
-        "surprise": (241, 196, 15),
-        "sad": (52, 152, 219),
-        "angry": (231, 76, 60),
-        "disgust": (22, 160, 133),
-        "fear": (142, 68, 173),
-    }
+    emotion_counts = Counter(dict.fromkeys(CLASS_NAMES, 0))
 
     # ==== Persistencia de detecciones ====
     last_detections = []
 
-    logger.info("Iniciando bucle de procesamiento de frames...")
+    # ==== Lote de frames pendientes de análisis ====
+    # pending_frames: (frame_id, frame_bgr) que se analizan juntos en un solo lote;
+    # el frame es el mismo objeto que en buffered (la copia RGB se hace al analizar).
+    # buffered: frames BGR a la espera de las detecciones del lote, junto con la
+    # posición en pending_frames del último frame analizado que les corresponde.
+    pending_frames = []
+    buffered = []
+    frame_bytes = max(1, frame_width * frame_height * 3)
+    max_buffered = max(1, MAX_BUFFER_MB * 1024 * 1024 // frame_bytes)
+
+    # ==== Pipeline concurrente: lectura → análisis → escritura ====
+    # Cada etapa usa un recurso distinto (decodificación, modelo, codificación),
+    # así que se solapan en hilos unidos por colas acotadas. None marca el fin.
+    read_queue = queue.Queue(maxsize=QUEUE_SIZE)
+    write_queue = queue.Queue(maxsize=QUEUE_SIZE)
+    stop_event = threading.Event()
+    errors = []
+
+    def flush_batch():
+        nonlocal last_detections
+        if not pending_frames:
+            return
+
+        try:
+            batch_results = analyze_frames_batch(
+                [cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB) for _, bgr in pending_frames]
+            )
+        except Exception as e:
+            ids = [fid for fid, _ in pending_frames]
+            logger.warning(f"Error analizando frames {ids}: {e}")
+            batch_results = [{"results": []} for _ in pending_frames]
+
+        # Contar las emociones de todo el lote de una vez
+        emotion_counts.update(
+            det["emotion"] for result in batch_results for det in result.get("results", [])
+        )
 
-    try:
+        # Detecciones vigentes tras cada frame analizado (persistencia)
+        current = last_detections
+        per_sample = []
+        for result in batch_results:
+            detections = result.get("results", [])
+            if detections:
+                current = prepare_detections(detections)
+            per_sample.append(current)
+
+        for frame, sample_pos in buffered:
+            write_queue.put((frame, per_sample[sample_pos]))
+
+        last_detections = current
+        pending_frames.clear()
+        buffered.clear()
+
+    def read_frames():
+        try:
+            while not stop_event.is_set():
+                ret, frame = cap.read()
+                if not ret:
+                    break
+
+                if frame is None or len(frame.shape) != 3:
+                    logger.warning("Frame inválido o sin canales RGB, se omite.")
+                    continue
+
+                frame_id = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+                read_queue.put((frame_id, frame))
+        except Exception as e:
+            logger.exception("Error leyendo frames del video")
+            errors.append(e)
+            stop_event.set()
+        finally:
+            read_queue.put(None)
+
+    def analyze_frames():
+        nonlocal processed_frames, analyzed_frames
+        prev_small = None       # Miniatura del último frame analizado
+        last_analyzed = 0       # Índice del último frame analizado
+        reader_done = False     # Ya se consumió el None del lector
+        try:
+            while True:
+                item = read_queue.get()
+                if item is None:
+                    reader_done = True
+                    break
+                if stop_event.is_set():
+                    continue  # Otra etapa falló: solo vaciar la cola
+                frame_id, frame = item
+                processed_frames += 1
+
+                # === Decidir si analizar: intervalo periódico o cambio de escena ===
+                small = cv2.cvtColor(
+                    cv2.resize(frame, DIFF_SIZE, interpolation=cv2.INTER_AREA),
+                    cv2.COLOR_BGR2GRAY,
+                )
+                diff = cv2.absdiff(small, prev_small).mean() if prev_small is not None else float("inf")
+                since_last = processed_frames - last_analyzed
+                # El muestreo periódico es incondicional: un cambio pequeño (p. ej. solo
+                # la cara) apenas mueve la media de toda la imagen
+                periodic = since_last >= frame_interval
+                motion = since_last >= min_interval and diff > MOTION_THRESHOLD
+
+                # === Frame a analizar: se acumula en el lote ===
+                if periodic or motion:
+                    analyzed_frames += 1
+                    prev_small = small
+                    last_analyzed = processed_frames
+                    pending_frames.append((frame_id, frame))
+                    buffered.append((frame, len(pending_frames) - 1))
+                    if len(pending_frames) >= BATCH_SIZE or len(buffered) >= max_buffered:
+                        flush_batch()
+                    continue
+
+                # === Frames intermedios ===
+                if pending_frames:
+                    # Esperan a las detecciones del último frame del lote
+                    buffered.append((frame, len(pending_frames) - 1))
+                    if len(buffered) >= max_buffered:
+                        flush_batch()
+                else:
+                    write_queue.put((frame, last_detections))
+
+            flush_batch()
+        except Exception as e:
+            logger.exception("Error analizando frames del video")
+            errors.append(e)
+            stop_event.set()
+            # Vaciar la cola para que el lector no quede bloqueado (si aún no terminó)
+            while not reader_done and read_queue.get() is not None:
+                pass
+        finally:
+            write_queue.put(None)
+
+    def write_frames():
+        failed = False
         while True:
-            ret, frame = cap.read()
-            if not ret:
+            item = write_queue.get()
+            if item is None:
                 break
-
-            if frame is None or len(frame.shape) != 3:
-                logger.warning("Frame inválido o sin canales RGB, se omite.")
-                continue
-
-            frame_id = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
-            processed_frames += 1
-
-            # === Usar detecciones previas en frames intermedios ===
-            if processed_frames % frame_interval != 0:
-                if last_detections:
-                    for det in last_detections:
-                        bbox = det.get("bbox") or det.get("box")
-                        if not bbox or len(bbox) != 4:
-                            continue
-                        x, y, w, h = map(int, bbox)
-                        emotion = det["emotion"]
-                        confidence = det["confidence"]
-
-                        color = COLORS.get(emotion, (0, 255, 0))
-                        label = f"{emotion.upper()} {confidence*100:.1f}%"
-
-                        cv2.rectangle(frame, (x, y), (x + w, y + h), color, 2)
-                        text_size, _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)
-                        text_w, text_h = text_size
-                        cv2.rectangle(frame, (x, y - 20), (x + text_w, y), color, -1)
-                        cv2.putText(frame, label, (x, y - 5),
-                                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1)
-                out.write(frame)
-                continue
-
-            # === Procesar frame actual ===
-            analyzed_frames += 1
-            ret, buffer = cv2.imencode('.jpg', frame)
-            if not ret:
-                continue
-
+            if failed:
+                continue  # Seguir vaciando la cola para no bloquear al analizador
+            frame, detections = item
             try:
-                result = analyze_bytes(buffer.tobytes())
-            except Exception as e:
-                logger.warning(f"Error analizando frame {frame_id}: {e}")
+                draw_detections(frame, detections)
                 out.write(frame)
-                continue
-
-            detections = result.get("results", [])
-            if detections:
-                last_detections = detections  # Guardar detecciones para persistencia
-                for det in detections:
-                    bbox = det.get("bbox") or det.get("box")
-                    if not bbox or len(bbox) != 4:
-                        continue
-
-                    x, y, w, h = map(int, bbox)
-                    emotion = det["emotion"]
-                    confidence = det["confidence"]
-
-                    color = COLORS.get(emotion, (0, 255, 0))
-                    label = f"{emotion.upper()} {confidence*100:.1f}%"
-
-                    cv2.rectangle(frame, (x, y), (x + w, y + h), color, 2)
-                    text_size, _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)
-                    text_w, text_h = text_size
-                    cv2.rectangle(frame, (x, y - 20), (x + text_w, y), color, -1)
-                    cv2.putText(frame, label, (x, y - 5),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 0), 1)
-
-                    # Actualizar contador de emociones
-                    if emotion in emotion_counts:
-                        emotion_counts[emotion] += 1
-
-            out.write(frame)
+            except Exception as e:
+                logger.exception("Error escribiendo frames del video")
+                errors.append(e)
+                stop_event.set()
+                failed = True
 
-        logger.info(f"Procesamiento completado. Frames analizados: {analyzed_frames}/{processed_frames}")
+    logger.info("Iniciando bucle de procesamiento de frames...")
 
+    threads = [
+        threading.Thread(target=read_frames, name="video-reader", daemon=True),
+        threading.Thread(target=analyze_frames, name="video-analyzer", daemon=True),
+        threading.Thread(target=write_frames, name="video-writer", daemon=True),
+    ]
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
     finally:
         cap.release()
         out.release()
 
+    if errors:
+        raise errors[0]
+    # False si no hubo NVENC o si se tuvo que volver a 'mp4v' durante la escritura
+    hw_encoded = getattr(out, "is_nvenc", False)
+    logger.info(f"Procesamiento completado. Frames analizados: {analyzed_frames}/{processed_frames}")
+
     # === Estadísticas ===
     elapsed = time.time() - start_time
     total = sum(emotion_counts.values()) or 1
     summary = {k: round((v / total) * 100, 2) for k, v in emotion_counts.items()}
 
-    # === Combinar audio ===
-    output_with_audio = merge_audio(video_path, output_path)
-    
-    compressed_path = compress_video(output_with_audio, output_with_audio)
+    # === Esperar el audio descargado en paralelo (si lo hay) ===
+    audio_path = video_path
+    if audio_future is not None:
+        try:
+            audio_path = audio_future.result(timeout=AUDIO_WAIT_TIMEOUT)
+        except Exception as e:
+            # Incluye el timeout: una descarga atascada no debe colgar la petición
+            logger.warning(f"⚠️ No se pudo obtener el audio, el video final irá sin audio: {e!r}")
 
+    # === Combinar audio y comprimir (una sola pasada de FFmpeg) ===
+    output_with_audio = merge_audio(audio_path, output_path, reencode=not hw_encoded)
 
     # === Subir a Google Cloud Storage ===
     try:
-        filename = os.path.basename(compressed_path)
+        filename = os.path.basename(output_with_audio)
         gcs_path = f"processed_videos/{filename}"
-        public_url = upload_to_gcs(compressed_path, gcs_path)
+        public_url = upload_to_gcs(output_with_audio, gcs_path)
 
         logger.info(f"✅ Video subido a GCS correctamente: {public_url}")
 
-        # Eliminar archivo local
-        os.remove(output_with_audio)
+        # Eliminar archivos locales
+        for path in {output_path, output_with_audio}:
+            os.remove(path)
         logger.info("🗑️ Archivo local eliminado tras la subida.")
     except Exception as e:
         logger.exception("Error subiendo el video a GCS")
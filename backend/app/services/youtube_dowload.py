@@ -1,10 +1,14 @@
 import os
 import uuid
+import shutil
 import logging
 import tempfile
+import threading
+from typing import Optional
 from fastapi import APIRouter, HTTPException, BackgroundTasks
 from pydantic import BaseModel
 from yt_dlp import YoutubeDL
+from yt_dlp.utils import DownloadCancelled
 
 # Importaremos el analizador en el siguiente paso
 from app.services.analyzer import analyze_bytes
@@ -27,12 +31,36 @@ class YouTubeRequest(BaseModel):
     url: str
 
 
+# ============================================================
+# Opciones comunes de yt_dlp
+# ============================================================
+def build_ydl_opts(format_selector: str, outtmpl: str, use_aria2c: bool = True) -> dict:
+    """
+    Opciones de yt_dlp compartidas por la descarga de video y la de audio.
+    Si aria2c está instalado (y use_aria2c) se usa como descargador externo (8 conexiones).
+    """
+    ydl_opts = {
+        "format": format_selector,
+        "outtmpl": outtmpl,
+        "quiet": True,
+        "no_warnings": True,
+        "noplaylist": True,
+        "ffmpeg_location": "C:/ffmpeg/bin",
+        "max_filesize": 500 * 1024 * 1024,  # 500 MB límite
+    }
+    if use_aria2c and shutil.which("aria2c"):
+        ydl_opts["external_downloader"] = {"http": "aria2c"}
+        ydl_opts["external_downloader_args"] = {"aria2c": ["-x", "8", "-s", "8"]}
+    return ydl_opts
+
+
 # ============================================================
 # Función auxiliar: descarga el video temporalmente
 # ============================================================
 def download_youtube_video(url: str) -> str:
     """
-    Descarga un video de YouTube usando yt_dlp.
+    Descarga solo la pista de video (≤480p) de YouTube usando yt_dlp.
+    El audio se descarga aparte con download_youtube_audio.
     Devuelve la ruta local del archivo descargado (en /tmp).
     """
 
@@ -41,17 +69,11 @@ def download_youtube_video(url: str) -> str:
     video_id = str(uuid.uuid4())[:8]
     output_path = os.path.join(tmp_dir, f"yt_{video_id}.mp4")
 
-    # Opciones de yt_dlp (solo video, sin audio para acelerar)
-    ydl_opts = {
-        "format": "bestvideo[height<=480]+bestaudio/best[height<=480]",
-        "merge_output_format": "mp4",
-        "outtmpl": output_path,
-        "quiet": True,
-        "no_warnings": True,
-        "noplaylist": True,
-        "ffmpeg_location": "C:/ffmpeg/bin",
-        "max_filesize": 500 * 1024 * 1024,  # 500 MB límite
-    }
+    # Solo video para empezar a procesar cuanto antes
+    ydl_opts = build_ydl_opts(
+        "bestvideo[height<=480][ext=mp4]/best[height<=480][ext=mp4]/best[height<=480]",
+        output_path,
+    )
 
     logger.info(f"Iniciando descarga de YouTube: {url}")
     logger.info(f"Ruta temporal: {output_path}")
@@ -67,4 +89,49 @@ def download_youtube_video(url: str) -> str:
 
     except Exception as e:
         logger.exception(f"Error al descargar video desde YouTube: {e}")
-        raise HTTPException(status_code=500, detail=f"Error al descargar video: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error al descargar video: {str(e)}")
+
+
+# ============================================================
+# Función auxiliar: descarga el audio temporalmente
+# ============================================================
+def download_youtube_audio(url: str, cancel_event: Optional[threading.Event] = None) -> str:
+    """
+    Descarga solo la pista de audio de YouTube (m4a si existe).
+    Pensada para ejecutarse en paralelo con el procesamiento del video.
+    Si se activa `cancel_event`, la descarga se aborta en el siguiente aviso de progreso.
+    Devuelve la ruta local del archivo descargado (en /tmp).
+    """
+    tmp_dir = tempfile.gettempdir()
+    audio_id = str(uuid.uuid4())[:8]
+    outtmpl = os.path.join(tmp_dir, f"yt_{audio_id}_audio.%(ext)s")
+
+    # Descargador nativo: aria2c no emite los avisos de progreso que permiten cancelar
+    ydl_opts = build_ydl_opts("bestaudio[ext=m4a]/bestaudio", outtmpl, use_aria2c=False)
+
+    if cancel_event is not None:
+        def abort_if_cancelled(_status):
+            if cancel_event.is_set():
+                raise DownloadCancelled("Descarga de audio cancelada.")
+        ydl_opts["progress_hooks"] = [abort_if_cancelled]
+
+    if cancel_event is not None and cancel_event.is_set():
+        raise DownloadCancelled("Descarga de audio cancelada.")
+
+    logger.info(f"Iniciando descarga de audio de YouTube: {url}")
+
+    try:
+        with YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(url, download=True)
+            output_path = ydl.prepare_filename(info)
+        if not os.path.exists(output_path):
+            raise FileNotFoundError("La descarga no generó el archivo esperado.")
+        logger.info(f"Audio descargado correctamente: {output_path}")
+        return output_path
+
+    except DownloadCancelled:
+        logger.info(f"Descarga de audio cancelada: {url}")
+        raise
+    except Exception as e:
+        logger.exception(f"Error al descargar audio desde YouTube: {e}")
+        raise HTTPException(status_code=500, detail=f"Error al descargar audio: {str(e)}")
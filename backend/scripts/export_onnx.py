@@ -0,0 +1,32 @@
+"""
+Exporta el modelo Keras de emociones a ONNX para servirlo con ONNX Runtime.
+
+Uso (requiere tf2onnx, que no forma parte de requirements.txt):
+    pip install tf2onnx
+    python scripts/export_onnx.py [ruta_modelo.h5] [salida.onnx]
+
+Para TensorRT en FP16 se puede generar además un engine:
+    trtexec --onnx=modelo_v2b.onnx --fp16 --saveEngine=modelo_v2b.plan
+"""
+import os
+import sys
+
+import tensorflow as tf
+import tf2onnx
+from tensorflow.keras.models import load_model
+
+DEFAULT_MODEL = os.path.join(os.path.dirname(__file__), "..", "app", "model", "modelo_v2b.h5")
+
+
+def main():
+    model_path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_MODEL
+    output_path = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(model_path)[0] + ".onnx"
+
+    model = load_model(model_path, compile=False)
+    spec = (tf.TensorSpec((None, 224, 224, 3), tf.float32, name="input"),)
+    tf2onnx.convert.from_keras(model, input_signature=spec, opset=15, output_path=output_path)
+    print(f"Modelo exportado a {output_path}")
+
+
+if __name__ == "__main__":
+    main()
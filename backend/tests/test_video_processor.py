@@ -0,0 +1,222 @@
+"""
+Pruebas del pipeline lectura → análisis → escritura de process_video.
+
+cv2, el analizador (modelo) y el uploader se sustituyen por dobles mínimos:
+aquí solo interesa la lógica concurrente de las etapas (orden, persistencia
+de detecciones y que un fallo en cualquier etapa no deje hilos bloqueados).
+"""
+import importlib
+import sys
+import threading
+import types
+
+import numpy as np
+import pytest
+
+FPS = 2  # frame_interval = 4, min_interval = 1
+SIZE = 8
+CLASS_NAMES = ["angry", "disgust", "fear", "happy", "sad", "surprise", "neutral"]
+
+
+# ==========================================================
+# DOBLES DE cv2, ANALIZADOR Y UPLOADER
+# ==========================================================
+def fake_cv2():
+    cv2 = types.ModuleType("cv2")
+    cv2.VideoCapture = object
+    cv2.CAP_FFMPEG = 0
+    cv2.CAP_PROP_HW_ACCELERATION = 0
+    cv2.VIDEO_ACCELERATION_ANY = 0
+    cv2.CAP_PROP_FPS = "fps"
+    cv2.CAP_PROP_FRAME_WIDTH = "width"
+    cv2.CAP_PROP_FRAME_HEIGHT = "height"
+    cv2.CAP_PROP_FRAME_COUNT = "count"
+    cv2.CAP_PROP_POS_FRAMES = "pos"
+    cv2.INTER_AREA = 0
+    cv2.COLOR_BGR2GRAY = "gray"
+    cv2.COLOR_BGR2RGB = "rgb"
+    cv2.FONT_HERSHEY_SIMPLEX = 0
+    # Miniatura constante: diferencia 0 entre frames, sin muestras por movimiento
+    cv2.resize = lambda img, size, interpolation=None: np.zeros((size[1], size[0], 3), np.uint8)
+    cv2.cvtColor = lambda img, code: img[..., 0] if code == "gray" else img[..., ::-1]
+    cv2.absdiff = lambda a, b: np.abs(a.astype(np.int16) - b.astype(np.int16))
+    cv2.getTextSize = lambda label, font, scale, thickness: ((len(label), 10), 0)
+    return cv2
+
+
+@pytest.fixture(scope="module")
+def vp():
+    analyzer = types.ModuleType("app.services.analyzer")
+    analyzer.CLASS_NAMES = CLASS_NAMES
+    analyzer.analyze_frames_batch = None
+    uploader = types.ModuleType("app.services.uploader")
+    uploader.upload_to_gcs = None
+
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setitem(sys.modules, "cv2", fake_cv2())
+        mp.setitem(sys.modules, "app.services.analyzer", analyzer)
+        mp.setitem(sys.modules, "app.services.uploader", uploader)
+        mp.delitem(sys.modules, "app.services.video_processor", raising=False)
+        module = importlib.import_module("app.services.video_processor")
+        yield module
+        mp.delitem(sys.modules, "app.services.video_processor", raising=False)
+
+
+def marker(frame):
+    """Índice (1..n) con el que se rellenó el frame."""
+    return int(frame[0, 0, 0])
+
+
+class FakeCapture:
+    def __init__(self, n_frames, fail_at=None):
+        self.n_frames = n_frames
+        self.fail_at = fail_at
+        self.pos = 0
+
+    def isOpened(self):
+        return True
+
+    def read(self):
+        if self.pos >= self.n_frames:
+            return False, None
+        self.pos += 1
+        if self.pos == self.fail_at:
+            raise RuntimeError("fallo de lectura")
+        return True, np.full((SIZE, SIZE, 3), self.pos, np.uint8)
+
+    def get(self, prop):
+        return {"fps": FPS, "width": SIZE, "height": SIZE,
+                "count": self.n_frames, "pos": self.pos}[prop]
+
+    def release(self):
+        pass
+
+
+class FakeWriter:
+    def __init__(self, path, fail_at=None):
+        self.path = path
+        self.fail_at = fail_at
+        self.frames = []
+
+    def write(self, frame):
+        if len(self.frames) + 1 == self.fail_at:
+            raise RuntimeError("fallo de escritura")
+        self.frames.append(marker(frame))
+
+    def release(self):
+        open(self.path, "wb").close()
+
+
+def analyze_ok(frames):
+    """Una cara por frame; la emoción depende del índice para seguir la persistencia."""
+    return [
+        {"results": [{"emotion": CLASS_NAMES[marker(f) % len(CLASS_NAMES)],
+                      "confidence": 0.9, "box": [0, 0, 4, 4]}]}
+        for f in frames
+    ]
+
+
+def analyze_bad(frames):
+    """Resultado sin 'confidence': prepare_detections falla fuera del try del lote."""
+    return [{"results": [{"emotion": "happy", "box": [0, 0, 4, 4]}]} for _ in frames]
+
+
+@pytest.fixture
+def pipeline(vp, monkeypatch, tmp_path):
+    """Prepara process_video con los dobles y devuelve una función que lo ejecuta con timeout."""
+    video_path = tmp_path / "input.mp4"
+    video_path.write_bytes(b"")
+    state = {"drawn": []}
+
+    def run(n_frames, analyze=analyze_ok, read_fail_at=None, write_fail_at=None):
+        monkeypatch.setattr(vp, "analyze_frames_batch", analyze)
+        monkeypatch.setattr(vp, "open_capture", lambda path: FakeCapture(n_frames, read_fail_at))
+        writer_holder = {}
+
+        def open_writer(path, fps, size):
+            writer_holder["writer"] = FakeWriter(path, write_fail_at)
+            return writer_holder["writer"]
+
+        monkeypatch.setattr(vp, "open_writer", open_writer)
+        monkeypatch.setattr(vp, "draw_detections",
+                            lambda frame, dets: state["drawn"].append((marker(frame), dets)))
+        monkeypatch.setattr(vp, "merge_audio", lambda original, processed, reencode=True: processed)
+        monkeypatch.setattr(vp, "upload_to_gcs", lambda path, gcs_path: "https://example/" + gcs_path)
+
+        outcome = {}
+
+        def target():
+            try:
+                outcome["result"] = vp.process_video(str(video_path))
+            except Exception as e:
+                outcome["error"] = e
+
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        thread.join(timeout=10)
+        assert not thread.is_alive(), "process_video quedó bloqueado"
+        return outcome, writer_holder.get("writer"), state["drawn"]
+
+    return run
+
+
+# ==========================================================
+# PRUEBAS
+# ==========================================================
+def test_frames_written_in_order_with_persisted_detections(pipeline):
+    outcome, writer, drawn = pipeline(30)
+
+    assert "error" not in outcome
+    assert writer.frames == list(range(1, 31))
+    # Escena estática: el muestreo periódico (cada 4 frames) sigue activo
+    analyzed = [1, 5, 9, 13, 17, 21, 25, 29]
+    assert outcome["result"]["frames_analyzed"] == len(analyzed)
+
+    for frame_id, dets in drawn:
+        source = max(a for a in analyzed if a <= frame_id)
+        emotion = CLASS_NAMES[source % len(CLASS_NAMES)]
+        assert [d["label"] for d in dets] == [f"{emotion.upper()} 90.0%"]
+
+
+def test_summary_counts_every_analyzed_frame(pipeline):
+    outcome, _, _ = pipeline(8)  # Analiza los frames 1 y 5
+
+    summary = outcome["result"]["summary"]
+    assert summary[CLASS_NAMES[1]] == 50.0
+    assert summary[CLASS_NAMES[5]] == 50.0
+
+
+def test_analyzer_failure_in_final_flush_does_not_hang(pipeline):
+    # 3 frames < BATCH_SIZE: el único lote se analiza tras consumir el fin del lector
+    outcome, _, _ = pipeline(3, analyze=analyze_bad)
+
+    assert isinstance(outcome["error"], KeyError)
+
+
+def test_analyzer_failure_mid_stream_does_not_hang(pipeline):
+    outcome, _, _ = pipeline(60, analyze=analyze_bad)
+
+    assert isinstance(outcome["error"], KeyError)
+
+
+def test_analyzer_exception_leaves_frames_without_detections(pipeline):
+    def analyze_raises(frames):
+        raise RuntimeError("fallo del modelo")
+
+    outcome, writer, drawn = pipeline(10, analyze=analyze_raises)
+
+    assert "error" not in outcome
+    assert writer.frames == list(range(1, 11))
+    assert all(dets == [] for _, dets in drawn)
+
+
+def test_reader_failure_does_not_hang(pipeline):
+    outcome, _, _ = pipeline(30, read_fail_at=10)
+
+    assert str(outcome["error"]) == "fallo de lectura"
+
+
+def test_writer_failure_does_not_hang(pipeline):
+    outcome, _, _ = pipeline(60, write_fail_at=3)
+
+    assert str(outcome["error"]) == "fallo de escritura"